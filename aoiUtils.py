@@ -0,0 +1,104 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Reading and normalising AOI polygons before they are used for searches."""
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+
+import geopandas as gpd
+import shapely
+from shapely.geometry import mapping
+
+DEFAULT_TILE_ZOOM = 16
+AOI_CACHE_DIR = "aoi_cache"
+AOI_CRS = "EPSG:4326"
+
+
+def tile_width_deg(zoom):
+    """Width in degrees of a web mercator tile at the given zoom level."""
+    return 360.0 / 2 ** zoom
+
+
+def simplify_tolerance(zoom):
+    """Simplification tolerance for an AOI searched with tiles at zoom.
+
+    Detail finer than a quarter tile cannot change which tiles intersect
+    the AOI in any meaningful way, as long as the simplified AOI still
+    covers the original (see normalize_aoi).
+    """
+    return tile_width_deg(zoom) / 4
+
+
+def read_aoi_file(filepath):
+    """Reads a polygon file into a GeoDataFrame in EPSG:4326.
+
+    Uses pyogrio with Arrow when available, which avoids building the
+    features in Python, and falls back to the default reader otherwise.
+    """
+    try:
+        gdf = gpd.read_file(filepath, engine="pyogrio", use_arrow=True)
+    except ImportError:
+        gdf = gpd.read_file(filepath)
+
+    if gdf.crs is not None and gdf.crs != AOI_CRS:
+        gdf = gdf.to_crs(AOI_CRS)
+    return gdf
+
+
+def normalize_aoi(geometry, zoom=DEFAULT_TILE_ZOOM):
+    """Repairs and simplifies an AOI geometry.
+
+    Invalid geometries are repaired, only the polygonal parts are kept and
+    the result is simplified to the tolerance for the tile zoom level.
+    The AOI is buffered outward by the tolerance first, so simplifying
+    cannot move the boundary inside the original and drop border tiles.
+    """
+    geometry = shapely.make_valid(geometry)
+    polygons = [part for part in getattr(geometry, "geoms", [geometry])
+                if part.geom_type in ("Polygon", "MultiPolygon")]
+    if not polygons:
+        raise ValueError(f"AOI has no polygonal area: {geometry.geom_type}")
+
+    geometry = shapely.unary_union(polygons)
+    tolerance = simplify_tolerance(zoom)
+    buffered = geometry.buffer(tolerance)
+    simplified = buffered.simplify(tolerance, preserve_topology=True)
+    # Rounding can leave the simplified boundary a hair inside the original; keep the buffer then.
+    return simplified if simplified.covers(geometry) else buffered
+
+
+def _content_hash(filepath, zoom):
+    digest = hashlib.sha256(Path(filepath).read_bytes())
+    digest.update(f"zoom={zoom}".encode())
+    return digest.hexdigest()
+
+
+def load_search_aoi(filepath, zoom=DEFAULT_TILE_ZOOM, cache_dir=AOI_CACHE_DIR):
+    """Returns the normalised first polygon of filepath as a GeoJSON dict.
+
+    Results are cached in cache_dir by a hash of the file contents and
+    zoom level, so the same AOI file is only normalised once.
+    """
+    cache_file = Path(cache_dir) / f"{_content_hash(filepath, zoom)}.geojson"
+    if cache_file.exists():
+        logging.info(f"Using cached AOI {cache_file} for {filepath}")
+        return json.loads(cache_file.read_text())
+
+    gdf = read_aoi_file(filepath)
+    raw_geometry = gdf.iloc[0].geometry
+    geometry = normalize_aoi(raw_geometry, zoom)
+    logging.info(f"Normalised AOI {filepath}: {shapely.get_num_coordinates(raw_geometry)} -> "
+                 f"{shapely.get_num_coordinates(geometry)} vertices")
+
+    search_aoi_json = json.dumps(mapping(geometry))
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(search_aoi_json)
+    return json.loads(search_aoi_json)
+
@@ -0,0 +1,131 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Change detection between consecutive captures of tile stacks."""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import warnings
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+
+from cubeUtils import TileCube, find_tile_stacks, frame_capture_date
+
+DEFAULT_CHANGE_THRESHOLD = 0.25
+
+
+def load_frame(frame_path, cube=None):
+    """Reads all bands of a frame as a float32 (y, x, band) array.
+
+    Pixel values are kept in the source units; compute_change normalises
+    each band. If the frame's capture is in cube it is read from there
+    instead of decoding the image.
+    """
+    position = cube.position(frame_capture_date(frame_path)) if cube is not None else None
+    if position is not None:
+        frame = cube.frame(position)
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(frame_path) as src:
+                frame = src.read()
+    return frame.transpose(1, 2, 0).astype(np.float32)
+
+
+def _change_summary(change, threshold):
+    return {
+        "mean_change": float(change.mean()),
+        "changed_fraction": float((change > threshold).mean()),
+    }
+
+
+def compute_change(prev_frame, curr_frame, threshold=DEFAULT_CHANGE_THRESHOLD):
+    """Returns the per-pixel change between two frames and its summary.
+
+    Each band of each frame is normalised by its median brightness first,
+    so that changes in illumination between captures are not reported as
+    change. The median is unaffected by changes covering less than half of
+    the frame, unlike the mean. The change is the mean absolute difference
+    across bands. Frames of different shapes are not captures of the same
+    tile and are rejected.
+    """
+    if prev_frame.shape != curr_frame.shape:
+        raise ValueError(f"Frame shapes differ: {prev_frame.shape} and {curr_frame.shape}")
+
+    bands = prev_frame.shape[-1]
+    prev_norm = prev_frame / np.maximum(np.median(prev_frame.reshape(-1, bands), axis=0), 1e-6)
+    curr_norm = curr_frame / np.maximum(np.median(curr_frame.reshape(-1, bands), axis=0), 1e-6)
+    change = np.abs(curr_norm - prev_norm).mean(axis=-1).astype(np.float32)
+    return change, _change_summary(change, threshold)
+
+
+def _cache_path(cache_dir, tile_name, prev_id, curr_id):
+    return Path(cache_dir) / tile_name / f"{prev_id}__{curr_id}.npz"
+
+
+def process_tile_stack(tile_name, frame_paths, cache_dir, threshold=DEFAULT_CHANGE_THRESHOLD, cube_dir=None):
+    """Computes change for each consecutive pair of frames in one tile stack.
+
+    Change maps are cached per frame pair, so when the stack grows only
+    the pairs involving new captures are computed. Frames are read from the
+    data cube in cube_dir where available. Returns one summary dict per pair.
+    """
+    cube = TileCube(cube_dir) if cube_dir is not None and Path(cube_dir).exists() else None
+    results = []
+    prev_frame = None
+    for prev_path, curr_path in zip(frame_paths[:-1], frame_paths[1:]):
+        cache_file = _cache_path(cache_dir, tile_name, prev_path.stem, curr_path.stem)
+        if cache_file.exists():
+            # The changed fraction depends on threshold, so it is recomputed from the cached change map.
+            with np.load(cache_file) as cached:
+                summary = _change_summary(cached["change"], threshold)
+            prev_frame = None
+            cached_result = True
+        else:
+            if prev_frame is None:
+                prev_frame = load_frame(prev_path, cube)
+            curr_frame = load_frame(curr_path, cube)
+            change, summary = compute_change(prev_frame, curr_frame, threshold)
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(cache_file, change=change)
+            prev_frame = curr_frame
+            cached_result = False
+
+        results.append({"tile": tile_name, "prev_outcome_id": prev_path.stem,
+                        "curr_outcome_id": curr_path.stem, "cached": cached_result, **summary})
+    return results
+
+
+def detect_changes(stack_dir, cache_dir="change_cache", threshold=DEFAULT_CHANGE_THRESHOLD, max_workers=None,
+                   cube_root=None):
+    """Runs change detection over every tile stack in stack_dir in parallel.
+
+    cube_root optionally holds the data cubes (see cubeUtils) to read
+    frames from. Returns a DataFrame with one row per tile and capture pair.
+    """
+    stacks = find_tile_stacks(stack_dir)
+    if not stacks:
+        logging.warning(f"No tile stacks with more than one georeferenced frame found in {stack_dir}")
+        return pd.DataFrame()
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_tile_stack, tile_name, frames, cache_dir, threshold,
+                                   Path(cube_root) / tile_name if cube_root is not None else None)
+                   for tile_name, frames in stacks.items()]
+        for future in futures:
+            results.extend(future.result())
+
+    results_df = pd.DataFrame(results)
+    new_pairs = int((~results_df["cached"]).sum())
+    logging.info(f"Change detection over {len(stacks)} tiles: {new_pairs} new pairs, "
+                 f"{len(results_df) - new_pairs} from cache")
+    return results_df
@@ -0,0 +1,329 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Memory-mapped time series data cubes for downloaded images."""
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+
+CUBE_ROOT = "cubes"
+DEFAULT_CHUNK_SIZE = 16
+INDEX_FILENAME = "index.json"
+FRAME_SUFFIXES = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+# Matches the capture dates in spotlite file names, e.g. "L1B_Tile_CD_2023-01-01T101010Z_ID_3"
+# and "CaptureDate_20230101T101010_MosaicCreated_...".
+CAPTURE_DATE_PATTERN = re.compile(r"(?<!\d)\d{4}-?\d{2}-?\d{2}(T\d{6})?(?!\d)")
+
+
+def frame_capture_date(frame_path):
+    """Returns the capture date in a frame's file name, or its modification time."""
+    match = CAPTURE_DATE_PATTERN.search(Path(frame_path).stem)
+    if match:
+        try:
+            return pd.Timestamp(match.group(0))
+        except ValueError:
+            pass
+    return pd.Timestamp(Path(frame_path).stat().st_mtime, unit="s")
+
+
+def frame_extent(frame_path):
+    """Returns (crs, bounds, shape) of a georeferenced frame, or None if it has no georeference."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.open(frame_path) as src:
+            if src.crs is None:
+                return None
+            return src.crs.to_string(), tuple(src.bounds), (src.count, src.height, src.width)
+
+
+def cube_name(extent):
+    """Returns the cube directory name for frames with the given frame_extent."""
+    return hashlib.sha1(json.dumps(extent).encode()).hexdigest()[:16]
+
+
+def is_frame(path):
+    """Returns whether path is an image file, leaving out full size animation mosaics.
+
+    create_tile_stack_animation writes each capture's mosaic twice, and
+    only the "_resized" copies share one extent per AOI.
+    """
+    path = Path(path)
+    return (path.suffix.lower() in FRAME_SUFFIXES
+            and not (path.stem.startswith("CaptureDate_") and not path.stem.endswith("_resized")))
+
+
+def list_frames(image_dir):
+    """Returns the frames anywhere under image_dir."""
+    return sorted(p for p in Path(image_dir).rglob("*") if is_frame(p))
+
+
+def list_new_frames(image_dir, since):
+    """Returns the frames directly in image_dir modified at or after the POSIX time since."""
+    image_dir = Path(image_dir)
+    if not image_dir.is_dir():
+        return []
+    return sorted(p for p in image_dir.iterdir() if is_frame(p) and p.stat().st_mtime >= since)
+
+
+def group_frames_by_extent(frame_paths):
+    """Returns {cube_name: [frame paths]} for the georeferenced frames in frame_paths.
+
+    Frames with the same extent and size are captures of one tile or one
+    AOI mosaic. Each group is in capture order with one frame per capture
+    date, so downloading a capture again does not repeat it.
+    """
+    groups = {}
+    for frame_path in frame_paths:
+        try:
+            extent = frame_extent(frame_path)
+        except OSError as e:
+            logging.warning(f"Could not read {frame_path}: {e}")
+            continue
+        if extent is not None:
+            groups.setdefault(cube_name(extent), []).append(frame_path)
+
+    for name, frames in groups.items():
+        by_date = {}
+        for frame_path in sorted(frames, key=lambda p: (frame_capture_date(p), p.name)):
+            by_date.setdefault(frame_capture_date(frame_path), frame_path)
+        groups[name] = list(by_date.values())
+    return groups
+
+
+def find_tile_stacks(stack_dir):
+    """Returns {tile_name: [frame paths]} of the tile stacks under stack_dir.
+
+    A stack is every georeferenced frame with the same extent and size,
+    wherever it is under stack_dir, e.g. the resized mosaics written into
+    images/ by create_tile_stack_animation or repeat downloads of a tile.
+    The tile name is the cube_name of the extent. Frames are returned in
+    capture order and only stacks of more than one capture are returned.
+    """
+    return {name: frames for name, frames in group_frames_by_extent(list_frames(stack_dir)).items()
+            if len(frames) > 1}
+
+
+class TileCube:
+    """Time x band x y x x cube of frames stored as chunked .npy files.
+
+    Frames are stored as raw pixels, in the band count and dtype of the
+    source images, in chunk files of chunk_size captures, memory-mapped on
+    read, with a sidecar index.json listing the captures and the
+    georeferenced extent of the frames. A capture is identified by its
+    capture date plus its outcome id where known, so the same capture
+    under another file name is not added twice. Reads of frames
+    and windows return views of the mapped chunks, so repeated passes come
+    from the OS page cache instead of decoding the source images again.
+    """
+
+    def __init__(self, cube_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.cube_dir = Path(cube_dir)
+        self.index_path = self.cube_dir / INDEX_FILENAME
+        self._chunks = {}
+        if self.index_path.exists():
+            self.index = json.loads(self.index_path.read_text())
+        else:
+            self.index = {"frame_shape": None, "dtype": None, "chunk_size": chunk_size,
+                          "crs": None, "bounds": None, "captures": []}
+
+    def __len__(self):
+        return len(self.index["captures"])
+
+    @property
+    def outcome_ids(self):
+        return [capture["outcome_id"] for capture in self.index["captures"]]
+
+    @property
+    def capture_dates(self):
+        return pd.to_datetime([capture["capture_date"] for capture in self.index["captures"]])
+
+    @property
+    def crs(self):
+        return self.index.get("crs")
+
+    @property
+    def bounds(self):
+        """(minx, miny, maxx, maxy) of the frames in the cube crs, if known."""
+        return self.index["bounds"]
+
+    @bounds.setter
+    def bounds(self, bounds):
+        self.index["bounds"] = list(bounds) if bounds is not None else None
+        self._write_index()
+
+    def position(self, capture_date, outcome_id=None):
+        """Returns the position of a capture, or None if it is not in the cube.
+
+        Captures match on capture date, and on outcome id if both are known.
+        """
+        capture_date = pd.Timestamp(capture_date).isoformat()
+        for position, capture in enumerate(self.index["captures"]):
+            if (capture["capture_date"] == capture_date
+                    and (outcome_id is None or capture["outcome_id"] in (None, outcome_id))):
+                return position
+        return None
+
+    def _chunk_path(self, chunk):
+        return self.cube_dir / f"chunk_{chunk:05d}.npy"
+
+    def _chunk(self, chunk, mode="r"):
+        """Returns the memory-mapped array of a chunk, reusing open maps for reads."""
+        if mode == "r" and chunk in self._chunks:
+            return self._chunks[chunk]
+        self._chunks.pop(chunk, None)
+        path = self._chunk_path(chunk)
+        if not path.exists():
+            shape = (self.index["chunk_size"], *self.index["frame_shape"])
+            return np.lib.format.open_memmap(path, mode="w+", dtype=self.index["dtype"], shape=shape)
+        array = np.load(path, mmap_mode=mode)
+        if mode == "r":
+            self._chunks[chunk] = array
+        return array
+
+    def _write_index(self):
+        self.cube_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.index))
+        tmp_path.replace(self.index_path)
+
+    def append(self, frame, capture_date, outcome_id=None):
+        """Appends a (band, y, x) frame. Returns False if the capture is already in the cube."""
+        if self.position(capture_date, outcome_id) is not None:
+            return False
+
+        frame = np.asarray(frame)
+        if self.index["frame_shape"] is None:
+            self.index["frame_shape"] = list(frame.shape)
+            self.index["dtype"] = frame.dtype.name
+        elif list(frame.shape) != self.index["frame_shape"]:
+            raise ValueError(f"Frame shape {frame.shape} does not match cube shape {self.index['frame_shape']}")
+        elif frame.dtype.name != self.index["dtype"]:
+            raise ValueError(f"Frame dtype {frame.dtype.name} does not match cube dtype {self.index['dtype']}")
+
+        position = len(self)
+        chunk, offset = divmod(position, self.index["chunk_size"])
+        self.cube_dir.mkdir(parents=True, exist_ok=True)
+        chunk_array = self._chunk(chunk, mode="r+")
+        chunk_array[offset] = frame
+        chunk_array.flush()
+        del chunk_array
+
+        self.index["captures"].append({"outcome_id": outcome_id,
+                                       "capture_date": pd.Timestamp(capture_date).isoformat()})
+        self._write_index()
+        return True
+
+    def append_image(self, image_path, capture_date, outcome_id=None):
+        """Decodes an image once, with all its bands, and appends it as a frame.
+
+        The crs and bounds of the first georeferenced image become the
+        extent of the cube.
+        """
+        if self.position(capture_date, outcome_id) is not None:
+            return False
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(image_path) as src:
+                frame = src.read()
+                crs = src.crs.to_string() if src.crs is not None else None
+                bounds = tuple(src.bounds)
+        self.append(frame, capture_date, outcome_id)
+        if crs is not None and self.bounds is None:
+            self.index["crs"] = crs
+            self.bounds = bounds
+        return True
+
+    def frame(self, position, window=None):
+        """Returns the (band, y, x) frame at position as a view of the mapped chunk.
+
+        window is an optional (row_off, col_off, height, width).
+        """
+        if not -len(self) <= position < len(self):
+            raise IndexError(f"Capture {position} out of range for cube of {len(self)}")
+        chunk, offset = divmod(position % len(self), self.index["chunk_size"])
+        frame = self._chunk(chunk)[offset]
+        if window is not None:
+            row_off, col_off, height, width = window
+            frame = frame[:, row_off:row_off + height, col_off:col_off + width]
+        return frame
+
+    def frame_for_capture(self, capture_date, outcome_id=None, window=None):
+        position = self.position(capture_date, outcome_id)
+        if position is None:
+            raise KeyError(f"No capture at {capture_date} in {self.cube_dir}")
+        return self.frame(position, window)
+
+    def select(self, start_date=None, end_date=None):
+        """Returns the positions of captures between the dates, in capture date order."""
+        dates = self.capture_dates
+        mask = np.ones(len(dates), dtype=bool)
+        if start_date is not None:
+            mask &= dates >= pd.Timestamp(start_date)
+        if end_date is not None:
+            mask &= dates <= pd.Timestamp(end_date)
+        positions = np.flatnonzero(mask)
+        return positions[np.argsort(dates[positions], kind="stable")]
+
+    def read(self, start_date=None, end_date=None, window=None):
+        """Returns a (time, band, y, x) array of the captures between the dates.
+
+        Only the selected frames and window are read from the mapped chunks.
+        """
+        positions = self.select(start_date, end_date)
+        if len(positions) == 0:
+            return np.empty((0, *self.index["frame_shape"]), dtype=self.index["dtype"])
+        return np.stack([self.frame(position, window) for position in positions])
+
+    def window_for_bounds(self, bounds):
+        """Converts (minx, miny, maxx, maxy) in the cube crs to a pixel window."""
+        if self.bounds is None:
+            raise ValueError("Cube bounds are not set.")
+        cube_minx, cube_miny, cube_maxx, cube_maxy = self.bounds
+        _, height, width = self.index["frame_shape"]
+        minx, miny, maxx, maxy = bounds
+
+        col_off = int(np.floor((minx - cube_minx) / (cube_maxx - cube_minx) * width))
+        col_end = int(np.ceil((maxx - cube_minx) / (cube_maxx - cube_minx) * width))
+        row_off = int(np.floor((cube_maxy - maxy) / (cube_maxy - cube_miny) * height))
+        row_end = int(np.ceil((cube_maxy - miny) / (cube_maxy - cube_miny) * height))
+        row_off, col_off = max(row_off, 0), max(col_off, 0)
+        return row_off, col_off, min(row_end, height) - row_off, min(col_end, width) - col_off
+
+
+def update_cubes(frame_paths, cube_root=CUBE_ROOT, outcome_id=None):
+    """Appends the new georeferenced frames in frame_paths to a cube in cube_root.
+
+    Frames with the same extent and size, i.e. repeat captures of one tile
+    or one AOI mosaic, share a cube named by cube_name. Captures already in
+    their cube are not decoded again. outcome_id is the outcome of the
+    frames, if known. Returns the number of frames added.
+    """
+    added = 0
+    for name, frames in group_frames_by_extent([Path(p) for p in frame_paths if is_frame(p)]).items():
+        cube = TileCube(Path(cube_root) / name)
+        for frame_path in frames:
+            try:
+                if cube.append_image(frame_path, frame_capture_date(frame_path), outcome_id):
+                    added += 1
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not add {frame_path} to a data cube: {e}")
+    logging.info(f"Added {added} frames to cubes in {cube_root}")
+    return added
+
+
+def update_cubes_from_images(image_dir, cube_root=CUBE_ROOT, outcome_id=None):
+    """Appends the new georeferenced frames anywhere under image_dir to the cubes in cube_root."""
+    return update_cubes(list_frames(image_dir), cube_root, outcome_id)
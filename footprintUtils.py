@@ -0,0 +1,205 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Array backed storage for large sets of capture footprints."""
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+FOOTPRINT_COLUMNS = ("capture_date", "satl:outcome_id", "cloud_cover", "id")
+
+
+class FootprintArray:
+    """Column store for capture footprints.
+
+    Geometries are kept as WKB in one contiguous byte buffer with int64
+    offsets (the Arrow large_binary layout), next to typed columns:
+    datetime64[ns] capture dates, categorical outcome ids (int32 codes),
+    float32 cloud cover and the archive item id of each tile. This avoids a shapely object per row until a
+    GeoDataFrame is actually needed.
+    """
+
+    def __init__(self, wkb_data, wkb_offsets, capture_date, outcome_codes,
+                 outcome_categories, cloud_cover, crs="EPSG:4326", item_id=None):
+        self.wkb_data = np.asarray(wkb_data, dtype=np.uint8)
+        self.wkb_offsets = np.asarray(wkb_offsets, dtype=np.int64)
+        self.capture_date = np.asarray(capture_date, dtype="datetime64[ns]")
+        self.outcome_codes = np.asarray(outcome_codes, dtype=np.int32)
+        self.outcome_categories = pd.Index(outcome_categories)
+        self.cloud_cover = np.asarray(cloud_cover, dtype=np.float32)
+        self.crs = crs
+        self._bounds = None
+
+        n = len(self.wkb_offsets) - 1
+        self.item_id = np.asarray(item_id if item_id is not None else [""] * max(n, 0), dtype=str)
+        if n < 0 or any(len(col) != n for col in (self.capture_date, self.outcome_codes, self.cloud_cover,
+                                                  self.item_id)):
+            raise ValueError("FootprintArray columns must all have the same length.")
+
+    @classmethod
+    def from_geometries(cls, geometries, capture_date, outcome_id, cloud_cover, crs="EPSG:4326", item_id=None):
+        """Builds a FootprintArray from shapely geometries and column values."""
+        wkb = shapely.to_wkb(np.asarray(geometries, dtype=object))
+        lengths = np.fromiter((len(b) for b in wkb), dtype=np.int64, count=len(wkb))
+        offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+
+        dates = pd.to_datetime(pd.Series(capture_date))
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+        outcome = pd.Categorical(outcome_id)
+
+        return cls(data, offsets, dates.to_numpy("datetime64[ns]"), outcome.codes,
+                   outcome.categories, np.asarray(cloud_cover, dtype=np.float32), crs, item_id)
+
+    @classmethod
+    def from_geodataframe(cls, gdf):
+        """Builds a FootprintArray from a search result GeoDataFrame.
+
+        Cloud cover is read from "cloud_cover", or "eo:cloud_cover" as
+        returned by the archive search, and item ids from "id" if present.
+        """
+        crs = gdf.crs.to_string() if gdf.crs is not None else None
+        cloud_cover = gdf["cloud_cover"] if "cloud_cover" in gdf else gdf["eo:cloud_cover"]
+        return cls.from_geometries(gdf.geometry.values, gdf["capture_date"].values,
+                                   gdf["satl:outcome_id"].values, cloud_cover.values, crs,
+                                   gdf["id"].values if "id" in gdf else None)
+
+    @classmethod
+    def concat(cls, arrays):
+        """Joins FootprintArrays, e.g. search result pages, into one."""
+        arrays = list(arrays)
+        if not arrays:
+            raise ValueError("Nothing to concatenate.")
+
+        categories = arrays[0].outcome_categories
+        for array in arrays[1:]:
+            categories = categories.union(array.outcome_categories, sort=False)
+        # The trailing -1 keeps missing outcome ids (code -1) missing.
+        codes = [np.append(categories.get_indexer(array.outcome_categories), -1)[array.outcome_codes]
+                 for array in arrays]
+
+        offsets = [arrays[0].wkb_offsets]
+        for array in arrays[1:]:
+            offsets.append(array.wkb_offsets[1:] + offsets[-1][-1])
+
+        return cls(np.concatenate([a.wkb_data for a in arrays]),
+                   np.concatenate(offsets),
+                   np.concatenate([a.capture_date for a in arrays]),
+                   np.concatenate(codes),
+                   categories,
+                   np.concatenate([a.cloud_cover for a in arrays]),
+                   arrays[0].crs,
+                   np.concatenate([a.item_id for a in arrays]))
+
+    def __len__(self):
+        return len(self.wkb_offsets) - 1
+
+    @property
+    def nbytes(self):
+        """Memory held by the column buffers."""
+        return (self.wkb_data.nbytes + self.wkb_offsets.nbytes + self.capture_date.nbytes
+                + self.outcome_codes.nbytes + self.cloud_cover.nbytes + self.item_id.nbytes)
+
+    @property
+    def outcome_id(self):
+        return pd.Categorical.from_codes(self.outcome_codes, self.outcome_categories)
+
+    @property
+    def geometries(self):
+        """Decodes the footprints into an array of shapely geometries."""
+        data = self.wkb_data.tobytes()
+        wkb = np.array([data[start:end] for start, end in zip(self.wkb_offsets[:-1], self.wkb_offsets[1:])],
+                       dtype=object)
+        return shapely.from_wkb(wkb)
+
+    @property
+    def bounds(self):
+        """(n, 4) float64 array of minx, miny, maxx, maxy per footprint."""
+        if self._bounds is None:
+            self._bounds = shapely.bounds(self.geometries)
+        return self._bounds
+
+    def take(self, indices):
+        """Returns a new FootprintArray with the rows at indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.wkb_offsets[indices]
+        lengths = self.wkb_offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = (np.arange(offsets[-1], dtype=np.int64)
+                     - np.repeat(offsets[:-1], lengths) + np.repeat(starts, lengths))
+
+        subset = FootprintArray(self.wkb_data[positions], offsets, self.capture_date[indices],
+                                self.outcome_codes[indices], self.outcome_categories,
+                                self.cloud_cover[indices], self.crs, self.item_id[indices])
+        if self._bounds is not None:
+            subset._bounds = self._bounds[indices]
+        return subset
+
+    def filter(self, mask):
+        """Returns a new FootprintArray with the rows where mask is True."""
+        return self.take(np.flatnonzero(mask))
+
+    def save(self, path):
+        """Writes the column buffers to an uncompressed .npz file."""
+        np.savez(path, wkb_data=self.wkb_data, wkb_offsets=self.wkb_offsets, capture_date=self.capture_date,
+                 outcome_codes=self.outcome_codes, outcome_categories=np.asarray(self.outcome_categories, dtype=str),
+                 cloud_cover=self.cloud_cover, crs=str(self.crs) if self.crs is not None else "",
+                 item_id=self.item_id)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a FootprintArray written by save."""
+        with np.load(path) as saved:
+            return cls(saved["wkb_data"], saved["wkb_offsets"], saved["capture_date"], saved["outcome_codes"],
+                       saved["outcome_categories"], saved["cloud_cover"], str(saved["crs"]) or None,
+                       saved["item_id"] if "item_id" in saved else None)
+
+    def to_geodataframe(self, index_by_date=True):
+        """Converts to the GeoDataFrame layout used by update_map_with_tiles.
+
+        The columns are copied into a new GeoDataFrame and the geometries
+        are decoded, so only convert the rows that are needed.
+        """
+        data = {
+            "capture_date": self.capture_date,
+            "satl:outcome_id": self.outcome_id,
+            "cloud_cover": self.cloud_cover,
+            "id": self.item_id,
+        }
+        gdf = gpd.GeoDataFrame(data, geometry=self.geometries, crs=self.crs)
+        if index_by_date:
+            gdf = gdf.set_index(pd.DatetimeIndex(gdf["capture_date"]))
+        return gdf
+
+    def to_arrow(self):
+        """Converts to a pyarrow Table with a geoarrow.wkb geometry column.
+
+        The geometry buffers are wrapped, not copied. Missing outcome ids
+        (code -1) become nulls.
+        """
+        import pyarrow as pa
+
+        n = len(self)
+        geometry = pa.Array.from_buffers(pa.large_binary(), n,
+                                         [None, pa.py_buffer(self.wkb_offsets), pa.py_buffer(self.wkb_data)])
+        outcome = pa.DictionaryArray.from_arrays(pa.array(self.outcome_codes, mask=self.outcome_codes < 0),
+                                                 pa.array(self.outcome_categories.astype(str)))
+        schema = pa.schema([
+            pa.field("geometry", pa.large_binary(), metadata={"ARROW:extension:name": "geoarrow.wkb"}),
+            pa.field("capture_date", pa.timestamp("ns")),
+            pa.field("satl:outcome_id", outcome.type),
+            pa.field("cloud_cover", pa.float32()),
+            pa.field("id", pa.string()),
+        ], metadata={"crs": str(self.crs)})
+        return pa.Table.from_arrays([geometry, pa.array(self.capture_date), outcome,
+                                     pa.array(self.cloud_cover), pa.array(self.item_id)], schema=schema)
+
@@ -0,0 +1,221 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Profiling hooks for the menu actions in spotlite_package_main."""
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_MODES = ("cprofile", "sample")
+DEFAULT_TOP_N = 25
+DEFAULT_SAMPLE_INTERVAL_SEC = 0.005
+DEFAULT_PEAK_POLL_SEC = 0.05
+PEAK_SNAPSHOT_GROWTH = 1.25
+PROFILER_THREAD_NAMES = ("StackSampler", "PeakSnapshotter")
+
+
+class StackSampler:
+    """Samples the stacks of all threads and counts collapsed stacks.
+
+    Each stack is rooted at its thread name, so work done in spotlite's
+    thread pools shows up next to the main thread. The counts are written
+    in the folded format ("a;b;c 42") read by flamegraph.pl, speedscope
+    and inferno.
+    """
+
+    def __init__(self, interval_sec=DEFAULT_SAMPLE_INTERVAL_SEC):
+        self.interval_sec = interval_sec
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_sec):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, f"Thread-{thread_id}")
+                if name in PROFILER_THREAD_NAMES:
+                    continue
+                self.stacks[f"{name};{_collapse_stack(frame)}"] += 1
+
+    def write_folded(self, filename):
+        with open(filename, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ThreadProfiler:
+    """cProfile for the calling thread and every thread started while it is enabled.
+
+    cProfile only sees the thread that enabled it, so a profiler is added
+    for each new thread through threading.setprofile and their stats are
+    merged. Threads already running when profiling starts are not seen.
+    """
+
+    def __init__(self):
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def _start_thread_profiler(self, *args):
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def enable(self):
+        threading.setprofile(self._start_thread_profiler)
+        self._start_thread_profiler()
+
+    def disable(self):
+        threading.setprofile(None)
+        # Profilers of other threads stop with their thread; this one is ours.
+        self.profilers[0].disable()
+
+    def stats(self, stream=None):
+        with self._lock:
+            return pstats.Stats(*self.profilers, stream=stream)
+
+
+class PeakSnapshotter:
+    """Keeps a tracemalloc snapshot taken close to the peak of traced memory.
+
+    A snapshot after the action only shows what is still held, so memory
+    is polled while the action runs and a new snapshot is taken whenever
+    it grows by PEAK_SNAPSHOT_GROWTH over the last one.
+    """
+
+    def __init__(self, interval_sec=DEFAULT_PEAK_POLL_SEC, growth=PEAK_SNAPSHOT_GROWTH):
+        self.interval_sec = interval_sec
+        self.growth = growth
+        self.snapshot = None
+        self.snapshot_size = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        tracemalloc.reset_peak()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="PeakSnapshotter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_sec):
+            self._check()
+
+    def _check(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if self.snapshot is None or current > self.snapshot_size * self.growth:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+
+def _collapse_stack(frame):
+    """Returns the stack ending at frame as 'root;...;leaf'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _write_allocation_report(snapshot, filename, top_n, peak_bytes):
+    stats = snapshot.statistics("lineno")
+    total_kib = sum(stat.size for stat in stats) / 1024
+    with open(filename, "w") as f:
+        f.write(f"Peak traced memory: {peak_bytes / 1024:.1f} KiB\n")
+        f.write(f"Top {top_n} allocation sites at peak (snapshot of {total_kib:.1f} KiB)\n")
+        for index, stat in enumerate(stats[:top_n], 1):
+            frame = stat.traceback[0]
+            f.write(f"#{index}: {frame.filename}:{frame.lineno}: "
+                    f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+
+
+@contextmanager
+def profile_action(action_name, mode=None, log_dir="log", top_n=DEFAULT_TOP_N):
+    """Profiles the wrapped block and writes the results into log_dir.
+
+    mode is one of PROFILE_MODES, or None to run the block unprofiled.
+    "cprofile" writes a .prof file (snakeviz, flameprof) and a text summary,
+    "sample" writes a .folded file ready for flame graph tools. Both modes
+    write a top_n allocation report from a tracemalloc snapshot taken near
+    the memory peak of the block.
+    """
+    if mode is None:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
+    now = datetime.now().strftime("%d-%m-%YT%H%M%S")
+    base_filename = Path(log_dir) / f"Profile-{action_name}-{now}"
+
+    profiler = ThreadProfiler() if mode == "cprofile" else StackSampler()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    peak_snapshotter = PeakSnapshotter()
+    peak_snapshotter.start()
+
+    start = time.perf_counter()
+    if mode == "cprofile":
+        profiler.enable()
+    else:
+        profiler.start()
+    try:
+        yield
+    finally:
+        if mode == "cprofile":
+            profiler.disable()
+        else:
+            profiler.stop()
+        elapsed_sec = time.perf_counter() - start
+        peak_snapshotter.stop()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+
+        if mode == "cprofile":
+            summary = io.StringIO()
+            stats = profiler.stats(stream=summary)
+            stats.dump_stats(f"{base_filename}.prof")
+            stats.sort_stats("cumulative").print_stats(top_n)
+            Path(f"{base_filename}-stats.txt").write_text(summary.getvalue())
+        else:
+            profiler.write_folded(f"{base_filename}.folded")
+        _write_allocation_report(peak_snapshotter.snapshot, f"{base_filename}-alloc.txt", top_n, peak_bytes)
+
+        logging.info(f"Profiled {action_name} in {elapsed_sec:.2f}s, results in {base_filename}*")
@@ -0,0 +1,253 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Local revisit model used to skip archive searches that cannot find new imagery."""
+
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping, shape
+
+from footprintUtils import FootprintArray
+
+REVISIT_MODEL_PATH = "databases/revisit_model.json"
+SEARCH_CACHE_DIR = "search_cache"
+DEFAULT_CELL_SIZE_DEG = 0.1
+DEFAULT_REVISIT_QUANTILE = 0.1
+DEFAULT_MIN_CAPTURES = 3
+DEFAULT_MAX_HISTORY = 50
+
+
+class RevisitModel:
+    """Capture history per grid cell and the revisit intervals derived from it.
+
+    Cells are on a global grid of cell_size_deg anchored at 0,0. A cell
+    cannot have new imagery before its last capture plus the given quantile
+    of its past revisit intervals; searches covering only such cells are
+    skipped. Cells with fewer than min_captures captures are always searched.
+    """
+
+    def __init__(self, cell_size_deg=DEFAULT_CELL_SIZE_DEG, quantile=DEFAULT_REVISIT_QUANTILE,
+                 min_captures=DEFAULT_MIN_CAPTURES, max_history=DEFAULT_MAX_HISTORY):
+        self.cell_size_deg = cell_size_deg
+        self.quantile = quantile
+        self.min_captures = min_captures
+        self.max_history = max_history
+        self.history = pd.DataFrame({"cell_x": pd.Series(dtype=np.int64),
+                                     "cell_y": pd.Series(dtype=np.int64),
+                                     "capture_date": pd.Series(dtype="datetime64[ns]")})
+        self.searches_avoided = 0
+        self.searches_made = 0
+
+    def _cells_for_bounds(self, bounds):
+        """Returns the cells (x, y) and source row covered by each bounding box."""
+        cell_min = np.floor(bounds[:, :2] / self.cell_size_deg).astype(np.int64)
+        cell_max = np.floor(bounds[:, 2:] / self.cell_size_deg).astype(np.int64)
+        nx = cell_max[:, 0] - cell_min[:, 0] + 1
+        ny = cell_max[:, 1] - cell_min[:, 1] + 1
+        counts = nx * ny
+
+        rows = np.repeat(np.arange(len(bounds)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cell_min[rows, 0] + k % nx[rows]
+        cell_y = cell_min[rows, 1] + k // nx[rows]
+        return cell_x, cell_y, rows
+
+    def update(self, footprints):
+        """Adds the captures in footprints (GeoDataFrame or FootprintArray) to the history."""
+        if isinstance(footprints, FootprintArray):
+            bounds = footprints.bounds
+            capture_date = footprints.capture_date
+        else:
+            bounds = footprints.geometry.bounds.to_numpy()
+            dates = pd.to_datetime(pd.Series(footprints["capture_date"].values))
+            if dates.dt.tz is not None:
+                dates = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+            capture_date = dates.to_numpy("datetime64[ns]")
+
+        cell_x, cell_y, rows = self._cells_for_bounds(bounds)
+        new_history = pd.DataFrame({"cell_x": cell_x, "cell_y": cell_y, "capture_date": capture_date[rows]})
+        history = pd.concat([self.history, new_history], ignore_index=True).drop_duplicates()
+        history = history.sort_values(["cell_x", "cell_y", "capture_date"])
+        self.history = history.groupby(["cell_x", "cell_y"]).tail(self.max_history).reset_index(drop=True)
+
+    def estimates(self):
+        """Returns a DataFrame per cell with the last capture and the earliest likely next capture."""
+        grouped = self.history.groupby(["cell_x", "cell_y"])["capture_date"]
+        intervals = grouped.diff().dropna().groupby([self.history["cell_x"], self.history["cell_y"]])
+
+        cells = pd.DataFrame({"last_capture": grouped.max(), "n_captures": grouped.size()})
+        cells["min_revisit"] = intervals.quantile(self.quantile)
+        cells["median_revisit"] = intervals.median()
+        cells["earliest_next"] = cells["last_capture"] + cells["min_revisit"]
+        cells.loc[cells["n_captures"] < self.min_captures, "earliest_next"] = pd.NaT
+        return cells
+
+    def search_cells(self, search_aoi, now=None):
+        """Returns the grid cells of search_aoi and which of them cannot have new imagery yet.
+
+        Returns (cell_keys, cell_boxes, can_skip): "x,y" keys as saved by
+        save, the cells as shapely boxes and a boolean array per cell.
+        """
+        now = pd.Timestamp(now or datetime.utcnow())
+        aoi = shape(search_aoi)
+        cell_x, cell_y, _ = self._cells_for_bounds(np.array([aoi.bounds]))
+        cell_boxes = shapely.box(cell_x * self.cell_size_deg, cell_y * self.cell_size_deg,
+                                 (cell_x + 1) * self.cell_size_deg, (cell_y + 1) * self.cell_size_deg)
+        in_aoi = shapely.intersects(cell_boxes, aoi)
+        cell_x, cell_y, cell_boxes = cell_x[in_aoi], cell_y[in_aoi], cell_boxes[in_aoi]
+
+        earliest_next = self.estimates()["earliest_next"]
+        cell_earliest = earliest_next.reindex(pd.MultiIndex.from_arrays([cell_x, cell_y])).to_numpy()
+        # Unknown cells (NaT) compare False, so they are always searched.
+        can_skip = cell_earliest > np.datetime64(now)
+
+        logging.info(f"Revisit model: {int(can_skip.sum())} of {len(can_skip)} cells cannot have new imagery yet")
+        cell_keys = np.array([f"{x},{y}" for x, y in zip(cell_x, cell_y)], dtype=object)
+        return cell_keys, cell_boxes, can_skip
+
+    def plan_search(self, search_aoi, now=None):
+        """Returns the part of search_aoi that may have new imagery, or None.
+
+        search_aoi is a GeoJSON geometry dict. None means every cell of the
+        AOI was checked too recently to have new captures and the search can
+        be skipped.
+        """
+        _, cell_boxes, can_skip = self.search_cells(search_aoi, now)
+        if can_skip.all():
+            self.searches_avoided += 1
+            return None
+
+        self.searches_made += 1
+        if not can_skip.any():
+            return search_aoi
+        refresh_area = shapely.unary_union(cell_boxes[~can_skip]).intersection(shape(search_aoi))
+        return mapping(refresh_area)
+
+    def summary(self):
+        total = self.searches_avoided + self.searches_made
+        return f"Revisit model avoided {self.searches_avoided} of {total} searches."
+
+    def save(self, path=REVISIT_MODEL_PATH):
+        cells = {}
+        for (cell_x, cell_y), dates in self.history.groupby(["cell_x", "cell_y"])["capture_date"]:
+            cells[f"{cell_x},{cell_y}"] = [d.isoformat() for d in dates]
+        model = {
+            "cell_size_deg": self.cell_size_deg,
+            "searches_avoided": self.searches_avoided,
+            "searches_made": self.searches_made,
+            "cells": cells,
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(model))
+
+    @classmethod
+    def load(cls, path=REVISIT_MODEL_PATH, quantile=DEFAULT_REVISIT_QUANTILE,
+             min_captures=DEFAULT_MIN_CAPTURES, max_history=DEFAULT_MAX_HISTORY,
+             cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        """Loads a saved model, or returns an empty one if path does not exist.
+
+        cell_size_deg only applies to a new model; a saved model keeps the
+        grid its history was recorded on.
+        """
+        if not Path(path).exists():
+            return cls(cell_size_deg, quantile, min_captures, max_history)
+
+        saved = json.loads(Path(path).read_text())
+        model = cls(saved["cell_size_deg"], quantile, min_captures, max_history)
+        model.searches_avoided = saved.get("searches_avoided", 0)
+        model.searches_made = saved.get("searches_made", 0)
+
+        rows = [(int(key.split(",")[0]), int(key.split(",")[1]), date)
+                for key, dates in saved["cells"].items() for date in dates]
+        if rows:
+            history = pd.DataFrame(rows, columns=["cell_x", "cell_y", "capture_date"])
+            history["capture_date"] = pd.to_datetime(history["capture_date"]).astype("datetime64[ns]")
+            model.history = history
+        return model
+
+
+def _search_cache_paths(cache_dir, search_aoi, start_date_str):
+    query = json.dumps({"aoi": search_aoi, "start_date": start_date_str}, sort_keys=True)
+    key = hashlib.sha256(query.encode()).hexdigest()
+    return Path(cache_dir) / f"{key}.npz", Path(cache_dir) / f"{key}.json"
+
+
+def refresh_search(get_tiles, model, search_aoi, start_date_str, end_date_str, cache_dir=SEARCH_CACHE_DIR,
+                   now=None):
+    """Searches search_aoi from start_date_str to end_date_str, reusing the last result of the same query.
+
+    get_tiles is spotlite's tile_manager.get_tiles. Searches that run up to
+    now are cached per AOI and start date, together with the date each
+    grid cell of the AOI was last searched. When such a query is repeated,
+    only the cells where model says new captures are possible are searched
+    again, from the oldest date those cells were last searched, and the new
+    tiles are added to the cached ones by item id. Skipped cells keep their
+    date, so captures that arrive earlier than the model expects are found
+    by a later refresh. If no cell can have new captures the cached tiles
+    are returned without a search. Every search result is added to the
+    model.
+
+    Returns a GeoDataFrame of the tiles with a data_age column in days, or
+    None if there are none.
+    """
+    now = pd.Timestamp(now or datetime.utcnow())
+    refresh_to_now = pd.Timestamp(end_date_str).normalize() >= now.normalize()
+    tiles_path, query_path = _search_cache_paths(cache_dir, search_aoi, start_date_str)
+    cell_keys, cell_boxes, can_skip = model.search_cells(search_aoi, now)
+
+    cached = None
+    searched_until = {}
+    to_search = np.ones(len(cell_keys), dtype=bool)
+    if refresh_to_now and tiles_path.exists() and query_path.exists():
+        cached = FootprintArray.load(tiles_path)
+        searched_until = json.loads(query_path.read_text()).get("cells", {})
+        to_search = ~can_skip
+
+    if not to_search.any():
+        model.searches_avoided += 1
+        logging.info(f"Reusing {len(cached)} cached tiles, no new imagery is possible in any cell")
+        tiles = cached
+    else:
+        model.searches_made += 1
+        query_aoi = search_aoi
+        if not to_search.all():
+            query_aoi = mapping(shapely.unary_union(cell_boxes[to_search]).intersection(shape(search_aoi)))
+        # Dates are YYYY-MM-DD strings, so the oldest sorts first.
+        query_start_str = min(searched_until.get(key, start_date_str) for key in cell_keys[to_search])
+
+        tiles = cached
+        tiles_gdf, num_tiles, _ = get_tiles(query_aoi, query_start_str, end_date_str)
+        if num_tiles > 0:
+            model.update(tiles_gdf)
+            new_tiles = FootprintArray.from_geodataframe(tiles_gdf)
+            if cached is not None:
+                # Tiles already cached are found again on the day a cell was last searched.
+                is_cached = np.isin(new_tiles.item_id, cached.item_id) & (new_tiles.item_id != "")
+                new_tiles = new_tiles.filter(~is_cached)
+                tiles = FootprintArray.concat([cached, new_tiles])
+            else:
+                tiles = new_tiles
+
+        if refresh_to_now and tiles is not None:
+            searched_until.update({key: now.strftime("%Y-%m-%d") for key in cell_keys[to_search]})
+            tiles_path.parent.mkdir(parents=True, exist_ok=True)
+            tiles.save(tiles_path)
+            query_path.write_text(json.dumps({"aoi": search_aoi, "start_date": start_date_str,
+                                              "cells": searched_until}))
+
+    if tiles is None or len(tiles) == 0:
+        return None
+    tiles_gdf = tiles.to_geodataframe(index_by_date=False)
+    tiles_gdf["data_age"] = (now - tiles_gdf["capture_date"]).dt.days
+    return tiles_gdf
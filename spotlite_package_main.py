@@ -8,7 +8,9 @@
 # standard library imports
 from datetime import datetime
 from pathlib import Path
+import argparse
 import os
+import time
 
 # third-party imports
 import webbrowser
@@ -26,6 +28,11 @@ from spotlite import Spotlite
 
 # application imports
 import config
+from profileUtils import profile_action, PROFILE_MODES, DEFAULT_TOP_N
+from changeUtils import detect_changes, DEFAULT_CHANGE_THRESHOLD
+from cubeUtils import update_cubes, update_cubes_from_images, list_new_frames, CUBE_ROOT
+from aoiUtils import load_search_aoi, DEFAULT_TILE_ZOOM
+from revisitUtils import RevisitModel, refresh_search, SEARCH_CACHE_DIR, DEFAULT_REVISIT_QUANTILE, DEFAULT_MIN_CAPTURES, DEFAULT_CELL_SIZE_DEG
 
 def get_lat_long_from_place(place):
     # The regex below matches a pattern like '-34.2355, 19.2157'
@@ -62,11 +69,30 @@ def _get_font() -> ImageFont:
 
     return font
 
+def _get_aoi_tile_zoom() -> int:
+    """Returns the tile zoom level AOIs are simplified for, from config if set."""
+    try:
+        return int(config.AOI_TILE_ZOOM)
+    except AttributeError:
+        return DEFAULT_TILE_ZOOM
+
+def _get_revisit_model():
+    """Returns the saved revisit model if config.REVISIT_MODEL_ENABLED is set, otherwise None."""
+    try:
+        if not config.REVISIT_MODEL_ENABLED:
+            return None
+    except AttributeError:
+        return None
+
+    return RevisitModel.load(quantile=getattr(config, "REVISIT_QUANTILE", DEFAULT_REVISIT_QUANTILE),
+                             min_captures=getattr(config, "REVISIT_MIN_CAPTURES", DEFAULT_MIN_CAPTURES),
+                             cell_size_deg=getattr(config, "REVISIT_CELL_SIZE_DEG", DEFAULT_CELL_SIZE_DEG))
+
 def ensure_dir(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def main():
+def main(profile=None, profile_top_n=DEFAULT_TOP_N):
     # Make Sure All The Directories Are Present
     ensure_dir("log")
     ensure_dir("images")
@@ -74,6 +100,10 @@ def main():
     ensure_dir("invalid_outcome_ids")
     ensure_dir("search_results")
     ensure_dir("points_to_monitor")
+    ensure_dir("change_cache")
+    ensure_dir("aoi_cache")
+    ensure_dir(SEARCH_CACHE_DIR)
+    ensure_dir(CUBE_ROOT)
 
     # Setup Logging
     now = datetime.now().strftime("%d-%m-%YT%H%M%S")
@@ -84,10 +114,15 @@ def main():
     logging.getLogger().addHandler(console)
 
     place = ""
+    aoi_tile_zoom = _get_aoi_tile_zoom()
 
     # print(f"Keys: {config.KEY_ID}, {config.KEY_SECRET}")
     spotlite = Spotlite(config.KEY_ID, config.KEY_SECRET)
 
+    def profiled(option):
+        """Profiles the wrapped call when --profile is set, leaving out the interactive prompts."""
+        return profile_action(f"Option{option}", profile, top_n=profile_top_n)
+
     while True:
         print("\nOptions:")
         print("1. Search And Animate Site.")
@@ -100,7 +135,9 @@ def main():
         print("8. Run Subscription Monitor.")
         print("9. Dump Footprints.")
         print("10. Satellite Tasking Menu.")
-        # print("11. Extract Objects.") - To Be Refactored.
+        print("11. Detect Changes In Tile Stacks.")
+        print("12. Update Revisit Model From Footprints.")
+        print("13. Add Images To Data Cubes.")
         print("q. For Quit...")
 
         user_choice = input("Enter your choice: ")
@@ -147,7 +184,11 @@ def main():
                 period_input = input("Set period between frames (seconds float):") or "1"
                 period_sec = float(period_input) 
 
-            spotlite.create_tile_stack_animation(points, width, start_date, end_date, save_and_animate, period_sec)
+            started = time.time()
+            with profiled('1'):
+                spotlite.create_tile_stack_animation(points, width, start_date, end_date, save_and_animate, period_sec)
+            if save_and_animate == "y":
+                update_cubes(list_new_frames("images", started))
 
             # extract_objects = input("Extract Objects (y/n)? [n]: ").lower() or "n"
 
@@ -162,8 +203,7 @@ def main():
                                                         filetypes=[("GeoJSON files", "*.geojson")])
             if geojson_filepath:
                 logging.info(f"GeoJSON file selected: {geojson_filepath}")
-                tiles_gdf = gpd.read_file(geojson_filepath)
-                search_aoi = tiles_gdf.iloc[0].geometry.__geo_interface__
+                search_aoi = load_search_aoi(geojson_filepath, aoi_tile_zoom)
             else:
                 logging.warning("No geojson file!")
                 break
@@ -178,7 +218,8 @@ def main():
             search_end_date_str = input("Enter end date (YYYY-MM-DD) or press enter for now: ") or end_date_str
             logging.warning(f"Date Range For Search: {search_start_date_str} - {search_end_date_str}")
 
-            spotlite.create_cloud_free_basemap(search_aoi, search_start_date_str, search_end_date_str)
+            with profiled('2'):
+                spotlite.create_cloud_free_basemap(search_aoi, search_start_date_str, search_end_date_str)
 
         elif user_choice == '3': # Create heatmap of imagery age.
             # Open the file dialog to select the GeoJSON file
@@ -189,8 +230,7 @@ def main():
                                                         filetypes=[("GeoJSON files", "*.geojson")])
             if geojson_filepath:
                 logging.info(f"GeoJSON file selected: {geojson_filepath}")
-                tiles_gdf = gpd.read_file(geojson_filepath)
-                search_aoi = tiles_gdf.iloc[0].geometry.__geo_interface__
+                search_aoi = load_search_aoi(geojson_filepath, aoi_tile_zoom)
             else:
                 logging.warning("No geojson file!")
                 break
@@ -205,7 +245,22 @@ def main():
             search_end_date_str = input("Enter end date (YYYY-MM-DD) or press enter for now: ") or end_date_str
             logging.warning(f"Date Range For Search: {search_start_date_str} - {search_end_date_str}")
 
-            spotlite.create_age_heatmap(search_aoi, search_start_date_str, search_end_date_str)
+            revisit_model = _get_revisit_model()
+            if revisit_model is None:
+                with profiled('3'):
+                    spotlite.create_age_heatmap(search_aoi, search_start_date_str, search_end_date_str)
+                continue
+
+            # Repeated searches up to now reuse the last result and only search where new imagery is possible.
+            with profiled('3'):
+                tiles_gdf = refresh_search(spotlite.tile_manager.get_tiles, revisit_model, search_aoi,
+                                           search_start_date_str, search_end_date_str)
+                revisit_model.save()
+                if tiles_gdf is not None:
+                    spotlite.tile_manager.age_heatmap(tiles_gdf)
+            print(revisit_model.summary())
+            if tiles_gdf is None:
+                logging.warning("No tiles found!")
 
         elif user_choice == '4': # Create Heatmap for Stack Depth
             logging.warning("Create Heatmap Of Depth Of Stack.")
@@ -217,8 +272,7 @@ def main():
                                                         filetypes=[("GeoJSON files", "*.geojson")])
             if geojson_filepath:
                 logging.info(f"GeoJSON file selected: {geojson_filepath}")
-                tiles_gdf = gpd.read_file(geojson_filepath)
-                search_aoi = tiles_gdf.iloc[0].geometry.__geo_interface__
+                search_aoi = load_search_aoi(geojson_filepath, aoi_tile_zoom)
             else:
                 logging.warning("No geojson file!")
                 break
@@ -233,7 +287,8 @@ def main():
             search_end_date_str = input("Enter end date (YYYY-MM-DD) or press enter for now: ") or end_date_str
             logging.warning(f"Date Range For Search: {search_start_date_str} - {search_end_date_str}")
 
-            spotlite.create_count_heatmap(search_aoi, search_start_date_str, search_end_date_str)
+            with profiled('4'):
+                spotlite.create_count_heatmap(search_aoi, search_start_date_str, search_end_date_str)
 
         elif user_choice == '5': # Create for heat map for cloud cover for latest tiles.
             # Open the file dialog to select the GeoJSON file
@@ -244,8 +299,7 @@ def main():
                                                         filetypes=[("GeoJSON files", "*.geojson")])
             if geojson_filepath:
                 logging.info(f"GeoJSON file selected: {geojson_filepath}")
-                input_gdf = gpd.read_file(geojson_filepath)
-                search_aoi = input_gdf.iloc[0].geometry.__geo_interface__
+                search_aoi = load_search_aoi(geojson_filepath, aoi_tile_zoom)
             else:
                 logging.warning("No geojson file!")
                 break
@@ -260,7 +314,8 @@ def main():
             search_end_date_str = input("Enter end date (YYYY-MM-DD) or press enter for now: ") or end_date_str
             logging.warning(f"Date Range For Search: {search_start_date_str} - {search_end_date_str}")
 
-            spotlite.create_cloud_heatmap(search_aoi, search_start_date_str, search_end_date_str)
+            with profiled('5'):
+                spotlite.create_cloud_heatmap(search_aoi, search_start_date_str, search_end_date_str)
 
             continue
         
@@ -285,8 +340,10 @@ def main():
             end_date = input("Enter end date (YYYY-MM-DD) or press enter for now: ") or end_date_str
             logging.info(f"Date Range For Search: {start_date} - {end_date}")
 
-            output_dir = None
-            spotlite.download_tiles(points, width, start_date, end_date, output_dir)
+            output_dir = f"images/Tiles_{datetime.now().strftime('%y-%m-%dT%H%M%S')}"
+            with profiled('6'):
+                spotlite.download_tiles(points, width, start_date, end_date, output_dir)
+            update_cubes_from_images(output_dir)
 
         elif user_choice == '7': # Download Tiles For Specific Image Id 
             outcome_id = input(f"Provide Image Outcome_ID: ") or None
@@ -298,13 +355,16 @@ def main():
 
             if output_dir is None:
                 output_dir = f"images/OutcomeId_{outcome_id}_{now}"
-            spotlite.download_image(outcome_id, output_dir)
+            with profiled('7'):
+                spotlite.download_image(outcome_id, output_dir)
+            update_cubes_from_images(output_dir, outcome_id=outcome_id)
             continue
 
         elif user_choice == '8': # Run Subscription Monitor.
             # period = input("Enter Minutes Between Monitoring Runs [Return for Default]: ") or "240"
             # period_int = int(period)
-            spotlite.monitor_subscriptions_for_captures()
+            with profiled('8'):
+                spotlite.monitor_subscriptions_for_captures()
         elif user_choice == '9': # Dump capture footprints for AOI and time range
             # Open the file dialog to select the GeoJSON file
             print("Provide search geojson polygon file.")
@@ -314,8 +374,7 @@ def main():
                                                         filetypes=[("GeoJSON files", "*.geojson")])
             if geojson_filepath:
                 logging.info(f"GeoJSON file selected: {geojson_filepath}")
-                input_gdf = gpd.read_file(geojson_filepath)
-                search_aoi = input_gdf.iloc[0].geometry.__geo_interface__
+                search_aoi = load_search_aoi(geojson_filepath, aoi_tile_zoom)
             else:
                 logging.warning("No geojson file!")
                 break
@@ -329,7 +388,8 @@ def main():
             search_start_date_str = input("Enter start date (YYYY-MM-DD, UTC) or press enter for 1 month ago: ") or one_month_ago_str
             search_end_date_str = input("Enter end date (YYYY-MM-DD, UTC or press enter for now: ") or end_date_str
 
-            spotlite.save_footprints(search_aoi, search_start_date_str, search_end_date_str)
+            with profiled('9'):
+                spotlite.save_footprints(search_aoi, search_start_date_str, search_end_date_str)
             
             continue
         elif user_choice == '10': # Manage Taskings.
@@ -351,27 +411,33 @@ def main():
 
                     task_params = gather_task_inputs()
 
-                    tasking_df = spotlite.tasking_manager.create_new_tasking(task_params)
+                    with profiled('10.1'):
+                        tasking_df = spotlite.tasking_manager.create_new_tasking(task_params)
                     print(f"Tasking Result: {tasking_df}")
                     continue
                 elif sub_choice == '2': # Check status of task
                     task_id = input("Enter Task Id: ")
-                    print(f"Status: {spotlite.tasking_manager.task_status(task_id)}")
+                    with profiled('10.2'):
+                        print(f"Status: {spotlite.tasking_manager.task_status(task_id)}")
                     continue
                 elif sub_choice == '3': # cancel_task
                     task_id = input("Enter Task Id: ")
-                    print(f"Status: {spotlite.tasking_manager.cancel_task(task_id)}")
+                    with profiled('10.3'):
+                        print(f"Status: {spotlite.tasking_manager.cancel_task(task_id)}")
                     continue
                 elif sub_choice == '4': # query_and_download_image
                     scene_set_id = input("Enter SceneSetID?: ")
                     download_dir = input("Target Relative Download Directory? (images):") or None
-                    print(f"Downloaded Image Filename: {spotlite.tasking_manager.download_image(scene_set_id, download_dir)}")
+                    with profiled('10.4'):
+                        print(f"Downloaded Image Filename: {spotlite.tasking_manager.download_image(scene_set_id, download_dir)}")
                     continue
                 elif sub_choice == '5': # Check Client Config
-                    print(f"Client Config: {spotlite.tasking_manager.check_account_config()}")
+                    with profiled('10.5'):
+                        print(f"Client Config: {spotlite.tasking_manager.check_account_config()}")
                 elif sub_choice == '6': # Search products by status.
                     status = input("Provide Status To Query [ALL]: ") or ""
-                    df = spotlite.tasking_manager.query_tasks_by_status(status)
+                    with profiled('10.6'):
+                        df = spotlite.tasking_manager.query_tasks_by_status(status)
                     pd.set_option('display.max_rows', None)  # Show all rows
                     pd.set_option('display.max_columns', None)  # Show all columns
                     pd.set_option('display.width', None)  # Auto-detect the display width
@@ -379,12 +445,14 @@ def main():
                     print(f"Product Columns: {df.columns}")
                     print(f"Products Result: {df}")
                 elif sub_choice == '7': # Check available products list.
-                    df = spotlite.tasking_manager.query_available_tasking_products()
+                    with profiled('10.7'):
+                        df = spotlite.tasking_manager.query_available_tasking_products()
                     print(f"Availble Products: \n{df}")
                 elif sub_choice == '8': # Check captures for task_id
                     task_id = input("Provide task_id: ")
                     if task_id:
-                        response_json = spotlite.tasking_manager.capture_list(task_id)
+                        with profiled('10.8'):
+                            response_json = spotlite.tasking_manager.capture_list(task_id)
                         if response_json is not None and 'capture_id' in response_json.columns:
                             for idx, row in response_json.iterrows():
                                 print(f"Capture ID: {row['capture_id']}, Start: {row['start']}, Satellite: {row['satellite_name']}, Status: {row['status']}")
@@ -395,7 +463,8 @@ def main():
                     # This runs as a service until it fails or is cancelled.
                     check_interval_min = (input(f"How many minutes between checks? [10min]: ")) or 10
                     check_interval_sec = check_interval_min
-                    spotlite.tasking_manager.monitor_task_status(check_interval_sec)
+                    with profiled('10.9'):
+                        spotlite.tasking_manager.monitor_task_status(check_interval_sec)
                     continue
                 elif sub_choice == 'q': # Return to main menu
                     break
@@ -403,6 +472,59 @@ def main():
                     print("Invalid Choice.")
                     continue
 
+        elif user_choice == '11': # Detect changes between consecutive captures of tile stacks.
+            stack_dir = input("Provide directory of georeferenced images (e.g. images): ")
+            if not stack_dir or not os.path.isdir(stack_dir):
+                print(f"Image directory '{stack_dir}' not found.")
+                continue
+            threshold_input = input(f"Change threshold (0-1 float) [{DEFAULT_CHANGE_THRESHOLD}]: ") or DEFAULT_CHANGE_THRESHOLD
+            try:
+                threshold = float(threshold_input)
+                if not 0 <= threshold <= 1:
+                    raise ValueError(f"{threshold} is outside 0-1")
+            except ValueError as ve:
+                print(f"Invalid change threshold: {ve}")
+                continue
+            with profiled('11'):
+                changes_df = detect_changes(stack_dir, threshold=threshold, cube_root=CUBE_ROOT)
+            if changes_df.empty:
+                print("No tile stacks found.")
+                continue
+
+            now = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+            changes_filename = f"search_results/Changes_{now}.csv"
+            changes_df.to_csv(changes_filename, index=False)
+            print(changes_df.sort_values("changed_fraction", ascending=False).head(20))
+            print(f"Change summary saved to {changes_filename}")
+            continue
+
+        elif user_choice == '12': # Add dumped footprints to the revisit model.
+            print("Provide footprints geojson file (from Dump Footprints).")
+            root = tk.Tk()
+            root.withdraw()
+            geojson_filepath = filedialog.askopenfilename(title="Select GeoJSON file",
+                                                        filetypes=[("GeoJSON files", "*.geojson")])
+            if not geojson_filepath:
+                logging.warning("No geojson file!")
+                continue
+
+            revisit_model = _get_revisit_model() or RevisitModel.load()
+            with profiled('12'):
+                revisit_model.update(gpd.read_file(geojson_filepath))
+            revisit_model.save()
+            print(f"Revisit model updated, {len(revisit_model.estimates())} cells tracked.")
+            continue
+
+        elif user_choice == '13': # Append georeferenced images from another directory to the data cubes.
+            image_dir = input("Provide directory of georeferenced images: ")
+            if not image_dir or not os.path.isdir(image_dir):
+                print(f"Image directory '{image_dir}' not found.")
+                continue
+            with profiled('13'):
+                added = update_cubes_from_images(image_dir)
+            print(f"Added {added} new frames to the data cubes in {CUBE_ROOT}/")
+            continue
+
         elif user_choice == 'q': # Q for quit
             print("Exiting. Goodbye!")
             break
@@ -523,5 +645,14 @@ def gather_task_inputs():
     map_desired_tasking_location(lat, lon)
     return task
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Spotlite example menu application.")
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=PROFILE_MODES, default=None,
+                        help="Profile each menu action and write the results to log/ [cprofile]")
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP_N,
+                        help=f"Number of entries in the profile and allocation reports [{DEFAULT_TOP_N}]")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(args.profile, args.profile_top)
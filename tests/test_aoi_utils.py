@@ -0,0 +1,98 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for aoiUtils."""
+
+import unittest
+from unittest import mock
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from shapely.geometry import Polygon, box, shape
+
+import aoiUtils
+from aoiUtils import normalize_aoi, read_aoi_file, load_search_aoi, simplify_tolerance
+
+
+def _detailed_polygon(n_vertices=5000):
+    """Circle with small jitter, like a detailed border polygon."""
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radius = 1 + 1e-6 * np.sin(angles * 997)
+    return Polygon(zip(radius * np.cos(angles), radius * np.sin(angles)))
+
+
+class TestNormalizeAoi(unittest.TestCase):
+    """Repair and simplification in normalize_aoi."""
+
+    def test_simplifies_detailed_polygon(self):
+        """Detail below the tolerance is removed."""
+        polygon = _detailed_polygon()
+        normalized = normalize_aoi(polygon, zoom=14)
+        self.assertLess(len(normalized.exterior.coords), len(polygon.exterior.coords))
+        self.assertLess(normalized.area, polygon.area * 1.02)
+
+    def test_covers_original(self):
+        """The simplified AOI never cuts into the original, so border tiles are kept."""
+        polygon = _detailed_polygon()
+        for zoom in (10, 14, 16):
+            self.assertTrue(normalize_aoi(polygon, zoom).covers(polygon))
+
+    def test_repairs_bowtie(self):
+        """Self-intersecting polygons are made valid."""
+        bowtie = Polygon([(0, 0), (1, 1), (1, 0), (0, 1), (0, 0)])
+        self.assertFalse(bowtie.is_valid)
+        normalized = normalize_aoi(bowtie)
+        self.assertTrue(normalized.is_valid)
+        self.assertTrue(normalized.covers(shapely.make_valid(bowtie)))
+        self.assertLess(normalized.area, 0.6)
+
+    def test_tolerance_shrinks_with_zoom(self):
+        """Higher zoom levels keep more detail."""
+        self.assertLess(simplify_tolerance(18), simplify_tolerance(10))
+
+
+class TestLoadSearchAoi(unittest.TestCase):
+    """Reading, reprojection and caching of AOI files."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp_dir.name) / "cache"
+        self.aoi_file = Path(self.tmp_dir.name) / "aoi.geojson"
+        gdf = gpd.GeoDataFrame({'name': ['aoi']}, geometry=[box(10, 10, 12, 11)], crs="EPSG:4326")
+        gdf.to_crs("EPSG:3857").to_file(self.aoi_file, driver="GeoJSON")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reprojects(self):
+        """Files in other CRSs are read in EPSG:4326."""
+        gdf = read_aoi_file(self.aoi_file)
+        np.testing.assert_allclose(gdf.total_bounds, [10, 10, 12, 11])
+
+    def test_cached(self):
+        """The normalised AOI is cached by file content and not read again."""
+        search_aoi = load_search_aoi(self.aoi_file, cache_dir=self.cache_dir)
+        self.assertEqual(search_aoi['type'], 'Polygon')
+        self.assertEqual(len(list(self.cache_dir.iterdir())), 1)
+        with mock.patch.object(aoiUtils, 'read_aoi_file', side_effect=AssertionError("AOI file read again")):
+            self.assertEqual(load_search_aoi(self.aoi_file, cache_dir=self.cache_dir), search_aoi)
+        self.assertEqual(len(list(self.cache_dir.iterdir())), 1)
+
+    def test_changed_file_not_cached(self):
+        """Editing the AOI file gives a new cache entry."""
+        load_search_aoi(self.aoi_file, cache_dir=self.cache_dir)
+        gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1)], crs="EPSG:4326").to_file(self.aoi_file, driver="GeoJSON")
+        search_aoi = load_search_aoi(self.aoi_file, cache_dir=self.cache_dir)
+        np.testing.assert_allclose(shape(search_aoi).bounds, (0, 0, 1, 1), atol=simplify_tolerance(16) * 1.01)
+        self.assertEqual(len(list(self.cache_dir.iterdir())), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
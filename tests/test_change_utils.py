@@ -0,0 +1,143 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for changeUtils."""
+
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+
+from changeUtils import compute_change, find_tile_stacks, load_frame, process_tile_stack, detect_changes
+from cubeUtils import cube_name, frame_extent, update_cubes_from_images
+
+
+def _write_frame(path, value, changed_block=False, bounds=(0, 0, 0.01, 0.01), count=3, dtype="uint8"):
+    frame = np.full((count, 32, 32), value, dtype=dtype)
+    if changed_block:
+        frame[:, :16, :16] = 255
+    with rasterio.open(path, "w", driver="GTiff", width=32, height=32, count=count, dtype=dtype,
+                       crs="EPSG:4326", transform=from_bounds(*bounds, 32, 32)) as dst:
+        dst.write(frame)
+
+
+class TestComputeChange(unittest.TestCase):
+    """Per-pixel change metrics for compute_change."""
+
+    def test_identical_frames(self):
+        """Identical frames show no change."""
+        frame = np.full((8, 8, 3), 0.5, dtype=np.float32)
+        change, summary = compute_change(frame, frame)
+        self.assertEqual(change.shape, (8, 8))
+        self.assertEqual(summary['changed_fraction'], 0.0)
+
+    def test_brightness_shift_ignored(self):
+        """A uniform change in illumination is not reported as change."""
+        frame = np.full((8, 8, 3), 0.4, dtype=np.float32)
+        _, summary = compute_change(frame, frame * 1.5)
+        self.assertAlmostEqual(summary['mean_change'], 0.0, places=5)
+
+    def test_local_change(self):
+        """A changed block is detected."""
+        prev = np.full((8, 8, 3), 0.4, dtype=np.float32)
+        curr = prev.copy()
+        curr[:4, :4] = 1.0
+        change, summary = compute_change(prev, curr)
+        self.assertGreater(change[0, 0], change[7, 7])
+        self.assertAlmostEqual(summary['changed_fraction'], 0.25)
+
+    def test_shape_mismatch(self):
+        """Frames of different shapes are rejected."""
+        with self.assertRaises(ValueError):
+            compute_change(np.zeros((8, 8, 3), dtype=np.float32), np.zeros((8, 6, 3), dtype=np.float32))
+
+
+class TestProcessTileStack(unittest.TestCase):
+    """Caching and incremental processing of tile stacks."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.stack_dir = Path(self.tmp_dir.name) / "images"
+        self.cache_dir = Path(self.tmp_dir.name) / "cache"
+        self.stack_dir.mkdir()
+        # Resized animation mosaics are written straight into images/.
+        self.frame_paths = [self.stack_dir / f"CaptureDate_2023010{day}T101010_MosaicCreated_{day}_resized.tif"
+                            for day in (1, 2, 3)]
+        _write_frame(self.frame_paths[0], 100)
+        _write_frame(self.frame_paths[1], 100, changed_block=True)
+        self.tile_name = cube_name(frame_extent(self.frame_paths[0]))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_find_tile_stacks(self):
+        """Frames with one extent form a stack in capture order."""
+        # Full size mosaics are left out even where they line up with the resized ones.
+        _write_frame(self.stack_dir / "CaptureDate_20230105T101010_MosaicCreated_5.tif", 100)
+        stacks = find_tile_stacks(self.stack_dir)
+        self.assertEqual(list(stacks), [self.tile_name])
+        self.assertEqual(stacks[self.tile_name], self.frame_paths[:2])
+
+    def test_find_tile_stacks_skips_other_layouts(self):
+        """Different tiles of one downloaded image are not a stack."""
+        image_dir = self.stack_dir / "OutcomeId_cccc"
+        image_dir.mkdir()
+        _write_frame(image_dir / "L1B_Tile_CD_2023-01-01T101010Z_ID_0.tif", 100, bounds=(1, 0, 1.01, 0.01))
+        _write_frame(image_dir / "L1B_Tile_CD_2023-01-01T101010Z_ID_1.tif", 100, bounds=(1.01, 0, 1.02, 0.01))
+        self.assertEqual(list(find_tile_stacks(self.stack_dir)), [self.tile_name])
+
+    def test_incremental(self):
+        """Only pairs with new captures are computed when the stack grows."""
+        frames = find_tile_stacks(self.stack_dir)[self.tile_name]
+        first = process_tile_stack(self.tile_name, frames, self.cache_dir)
+        self.assertEqual([r['cached'] for r in first], [False])
+
+        _write_frame(self.frame_paths[2], 100, changed_block=True)
+        frames = find_tile_stacks(self.stack_dir)[self.tile_name]
+        second = process_tile_stack(self.tile_name, frames, self.cache_dir)
+        self.assertEqual([r['cached'] for r in second], [True, False])
+        self.assertAlmostEqual(second[0]['mean_change'], first[0]['mean_change'])
+        self.assertAlmostEqual(second[1]['changed_fraction'], 0.0)
+
+    def test_cached_pair_uses_new_threshold(self):
+        """A cached pair is summarised with the threshold of the current run."""
+        frames = find_tile_stacks(self.stack_dir)[self.tile_name]
+        process_tile_stack(self.tile_name, frames, self.cache_dir)
+        rerun = process_tile_stack(self.tile_name, frames, self.cache_dir, threshold=10.0)
+        self.assertTrue(rerun[0]['cached'])
+        self.assertEqual(rerun[0]['changed_fraction'], 0.0)
+
+    def test_reads_from_cube(self):
+        """Frames in a data cube give the same result as decoding the images."""
+        cube_root = Path(self.tmp_dir.name) / "cubes"
+        update_cubes_from_images(self.stack_dir, cube_root)
+        frames = find_tile_stacks(self.stack_dir)[self.tile_name]
+        from_images = process_tile_stack(self.tile_name, frames, self.cache_dir)
+        from_cube = process_tile_stack(self.tile_name, frames, Path(self.tmp_dir.name) / "cache2",
+                                       cube_dir=cube_root / self.tile_name)
+        self.assertAlmostEqual(from_cube[0]['mean_change'], from_images[0]['mean_change'])
+
+    def test_all_bands_in_source_dtype(self):
+        """Frames of more than three bands and 16 bit pixels are read whole."""
+        for frame_path, changed_block in zip(self.frame_paths[:2], (False, True)):
+            _write_frame(frame_path, 1000, changed_block, count=4, dtype="uint16")
+        self.assertEqual(load_frame(self.frame_paths[0]).shape, (32, 32, 4))
+        results = process_tile_stack(self.tile_name, self.frame_paths[:2], self.cache_dir)
+        self.assertAlmostEqual(results[0]['changed_fraction'], 0.25)
+
+    def test_detect_changes(self):
+        """The changed block, a quarter of the tile, is the changed fraction."""
+        results_df = detect_changes(self.stack_dir, self.cache_dir, max_workers=1)
+        self.assertEqual(len(results_df), 1)
+        self.assertAlmostEqual(results_df['changed_fraction'].iloc[0], 0.25, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for cubeUtils."""
+
+import os
+import unittest
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+
+from cubeUtils import TileCube, cube_name, frame_extent, list_new_frames, update_cubes, update_cubes_from_images
+
+
+def _frame(value, shape=(3, 8, 10)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def _write_geotiff(path, value, bounds=(0, 0, 1, 1), count=3, dtype="uint8"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(path, "w", driver="GTiff", width=6, height=6, count=count, dtype=dtype,
+                       crs="EPSG:4326", transform=from_bounds(*bounds, 6, 6)) as dst:
+        dst.write(np.full((count, 6, 6), value, dtype=dtype))
+
+
+class TestTileCube(unittest.TestCase):
+    """Appending to and reading from TileCube."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cube_dir = Path(self.tmp_dir.name) / "cube"
+        self.cube = TileCube(self.cube_dir, chunk_size=2)
+        for i, date in enumerate(['2023-01-03', '2023-01-01', '2023-01-02']):
+            self.cube.append(_frame(i), date, f"outcome_{i}")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunks(self):
+        """Frames are spread over chunk files of chunk_size captures."""
+        self.assertEqual(len(self.cube), 3)
+        self.assertEqual(sorted(p.name for p in self.cube_dir.glob("chunk_*.npy")),
+                         ["chunk_00000.npy", "chunk_00001.npy"])
+
+    def test_frame_is_memory_mapped_view(self):
+        """Frames are views of the mapped chunk, not copies."""
+        frame = self.cube.frame(2)
+        self.assertIsInstance(frame.base, np.memmap)
+        self.assertEqual(int(frame[0, 0, 0]), 2)
+
+    def test_duplicate_capture_skipped(self):
+        """Appending a capture again is a no-op, and captures without an outcome id match on date."""
+        self.assertFalse(self.cube.append(_frame(9), '2023-01-03', "outcome_0"))
+        self.assertFalse(self.cube.append(_frame(9), '2023-01-03'))
+        self.assertTrue(self.cube.append(_frame(9), '2023-01-03', "outcome_9"))
+        self.assertEqual(len(self.cube), 4)
+
+    def test_shape_mismatch(self):
+        """Frames must match the cube shape and dtype."""
+        with self.assertRaises(ValueError):
+            self.cube.append(_frame(1, (3, 4, 4)), '2023-01-04')
+        with self.assertRaises(ValueError):
+            self.cube.append(_frame(1).astype(np.uint16), '2023-01-04')
+
+    def test_read_by_time_and_window(self):
+        """Reads are ordered by capture date and cut to the window."""
+        stack = self.cube.read(start_date='2023-01-02', window=(2, 3, 4, 5))
+        self.assertEqual(stack.shape, (2, 3, 4, 5))
+        self.assertEqual([int(f[0, 0, 0]) for f in stack], [2, 0])
+
+    def test_reopen(self):
+        """A reopened cube sees the same captures and can be appended to."""
+        reopened = TileCube(self.cube_dir)
+        self.assertEqual(reopened.outcome_ids, ["outcome_0", "outcome_1", "outcome_2"])
+        self.assertTrue(reopened.append(_frame(3), '2023-01-04', "outcome_3"))
+        self.assertEqual(int(reopened.frame(3)[0, 0, 0]), 3)
+        self.assertEqual(int(reopened.frame(2)[0, 0, 0]), 2)
+
+    def test_window_for_bounds(self):
+        """Geographic bounds map to pixel windows."""
+        self.cube.bounds = (0, 0, 10, 8)
+        self.assertEqual(self.cube.window_for_bounds((2, 1, 5, 4)), (4, 2, 3, 3))
+
+
+class TestUpdateCubesFromImages(unittest.TestCase):
+    """Building cubes from downloaded images."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = Path(self.tmp_dir.name) / "images"
+        self.cube_root = Path(self.tmp_dir.name) / "cubes"
+        _write_geotiff(self.image_dir / "Tiles_1" / "L1B_Tile_CD_2023-01-01T101010Z_ID_0.tif", 0)
+        _write_geotiff(self.image_dir / "Tiles_1" / "L1B_Tile_CD_2023-01-01T101010Z_ID_1.tif", 0, (1, 0, 2, 1))
+        _write_geotiff(self.image_dir / "Tiles_2" / "L1B_Tile_CD_2023-01-02T101010Z_ID_0.tif", 50)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_incremental(self):
+        """Only frames not yet in a cube are added."""
+        self.assertEqual(update_cubes_from_images(self.image_dir, self.cube_root), 3)
+        self.assertEqual(update_cubes_from_images(self.image_dir, self.cube_root), 0)
+
+    def test_cube_per_extent(self):
+        """Repeat captures of one tile share a cube that records its extent."""
+        update_cubes_from_images(self.image_dir, self.cube_root)
+        self.assertEqual(len(list(self.cube_root.iterdir())), 2)
+
+        frame_path = self.image_dir / "Tiles_2" / "L1B_Tile_CD_2023-01-02T101010Z_ID_0.tif"
+        cube = TileCube(self.cube_root / cube_name(frame_extent(frame_path)))
+        self.assertEqual(len(cube), 2)
+        self.assertEqual(str(cube.capture_dates[1].date()), "2023-01-02")
+        self.assertEqual(int(cube.frame_for_capture("2023-01-02T10:10:10")[0, 0, 0]), 50)
+        self.assertEqual(cube.crs, "EPSG:4326")
+        self.assertEqual(cube.window_for_bounds((0, 0.5, 0.5, 1)), (0, 0, 3, 3))
+
+
+    def test_source_bands_and_dtype(self):
+        """Frames keep the band count and dtype of the source images."""
+        frame_path = self.image_dir / "Tiles_3" / "L1B_Tile_CD_2023-01-03T101010Z_ID_0.tif"
+        _write_geotiff(frame_path, 4000, (5, 5, 6, 6), count=4, dtype="uint16")
+        update_cubes_from_images(self.image_dir, self.cube_root)
+
+        cube = TileCube(self.cube_root / cube_name(frame_extent(frame_path)))
+        self.assertEqual(cube.index["dtype"], "uint16")
+        self.assertEqual(cube.frame(0).shape, (4, 6, 6))
+        self.assertEqual(int(cube.frame(0)[3, 0, 0]), 4000)
+
+    def test_renamed_mosaics_not_repeated(self):
+        """Mosaics of a capture created again under a new name are not added twice."""
+        for created in ("20230105T000000", "20230106T000000"):
+            for day in (1, 2):
+                stem = f"CaptureDate_2023010{day}T101010_MosaicCreated_{created}"
+                _write_geotiff(self.image_dir / f"{stem}.tiff", day, (0, 0, 3, 3))
+                _write_geotiff(self.image_dir / f"{stem}_resized.tiff", day, (0, 0, 2, 2))
+            update_cubes_from_images(self.image_dir, self.cube_root)
+
+        frame_path = self.image_dir / "CaptureDate_20230101T101010_MosaicCreated_20230105T000000_resized.tiff"
+        cube = TileCube(self.cube_root / cube_name(frame_extent(frame_path)))
+        self.assertEqual(len(cube), 2)
+        self.assertEqual(len(list(self.cube_root.iterdir())), 3)
+
+    def test_new_frames_only(self):
+        """Only the frames an action just wrote directly into a directory are listed."""
+        since = time.time() + 1
+        frame_path = self.image_dir / "CaptureDate_20230103T101010_MosaicCreated_20230105T000000_resized.tiff"
+        _write_geotiff(frame_path, 7)
+        os.utime(frame_path, (since, since))
+        self.assertEqual(list_new_frames(self.image_dir, since), [frame_path])
+        self.assertEqual(update_cubes(list_new_frames(self.image_dir, since), self.cube_root), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for footprintUtils."""
+
+import unittest
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+from footprintUtils import FootprintArray
+
+
+class TestFootprintArray(unittest.TestCase):
+    """Conversions and selections for FootprintArray."""
+
+    def setUp(self):
+        data = {'capture_date': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-03']),
+                'satl:outcome_id': ['aaaa', 'bbbb', 'aaaa'],
+                'geometry': [box(0, 0, 1, 1), box(1, 1, 3, 3), box(-1, -1, 0, 0)],
+                'cloud_cover': [10, 55.5, 0],
+                'id': ['aaaa_0', 'bbbb_0', 'aaaa_1']}
+        self.tiles_gdf = gpd.GeoDataFrame(data, crs="EPSG:4326")
+        self.footprints = FootprintArray.from_geodataframe(self.tiles_gdf)
+
+    def test_column_types(self):
+        """Columns are stored with compact dtypes."""
+        self.assertEqual(len(self.footprints), 3)
+        self.assertEqual(self.footprints.capture_date.dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(self.footprints.cloud_cover.dtype, np.float32)
+        self.assertEqual(self.footprints.outcome_codes.dtype, np.int32)
+        self.assertEqual(list(self.footprints.outcome_categories), ['aaaa', 'bbbb'])
+
+    def test_round_trip(self):
+        """Converting back gives the layout update_map_with_tiles expects."""
+        gdf = self.footprints.to_geodataframe()
+        self.assertIsInstance(gdf, gpd.GeoDataFrame)
+        self.assertIsInstance(gdf.index, pd.DatetimeIndex)
+        self.assertEqual(list(gdf['satl:outcome_id']), ['aaaa', 'bbbb', 'aaaa'])
+        self.assertTrue(gdf.geometry.reset_index(drop=True).geom_equals(self.tiles_gdf.geometry).all())
+        self.assertEqual(gdf.crs, self.tiles_gdf.crs)
+
+    def test_bounds(self):
+        """Bounds are computed per footprint."""
+        np.testing.assert_array_equal(self.footprints.bounds[1], [1, 1, 3, 3])
+
+    def test_filter(self):
+        """Filtering keeps geometries aligned with their columns."""
+        cloudy = self.footprints.filter(self.footprints.cloud_cover > 5)
+        self.assertEqual(len(cloudy), 2)
+        self.assertEqual(list(cloudy.outcome_id), ['aaaa', 'bbbb'])
+        self.assertTrue(cloudy.geometries[1].equals(box(1, 1, 3, 3)))
+        self.assertEqual(list(cloudy.item_id), ['aaaa_0', 'bbbb_0'])
+
+    def test_concat(self):
+        """Concatenation merges the outcome id categories."""
+        other = FootprintArray.from_geometries([box(5, 5, 6, 6)], ['2023-02-01'], ['cccc'], [1.0])
+        joined = FootprintArray.concat([self.footprints, other])
+        self.assertEqual(len(joined), 4)
+        self.assertEqual(list(joined.outcome_id), ['aaaa', 'bbbb', 'aaaa', 'cccc'])
+        self.assertTrue(joined.geometries[3].equals(box(5, 5, 6, 6)))
+
+    def test_save_load(self):
+        """Arrays survive a save and load unchanged."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'footprints.npz'
+            self.footprints.save(path)
+            loaded = FootprintArray.load(path)
+        np.testing.assert_array_equal(loaded.wkb_data, self.footprints.wkb_data)
+        np.testing.assert_array_equal(loaded.capture_date, self.footprints.capture_date)
+        self.assertEqual(list(loaded.outcome_id), ['aaaa', 'bbbb', 'aaaa'])
+        self.assertEqual(list(loaded.item_id), ['aaaa_0', 'bbbb_0', 'aaaa_1'])
+        self.assertEqual(loaded.crs, "EPSG:4326")
+
+    def test_save_load_without_crs(self):
+        """A missing CRS stays missing after a save and load."""
+        footprints = FootprintArray.from_geometries([box(0, 0, 1, 1)], ['2023-01-01'], ['aaaa'], [1.0], crs=None)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'footprints.npz'
+            footprints.save(path)
+            loaded = FootprintArray.load(path)
+        self.assertIsNone(loaded.crs)
+        self.assertIsNone(loaded.to_geodataframe().crs)
+
+    def test_mismatched_columns(self):
+        """Columns of different length are rejected."""
+        with self.assertRaises(ValueError):
+            FootprintArray(self.footprints.wkb_data, self.footprints.wkb_offsets,
+                           self.footprints.capture_date[:2], self.footprints.outcome_codes,
+                           self.footprints.outcome_categories, self.footprints.cloud_cover)
+
+    def test_search_cloud_cover_column(self):
+        """The eo:cloud_cover column of archive search results is used."""
+        search_gdf = self.tiles_gdf.rename(columns={'cloud_cover': 'eo:cloud_cover'})
+        footprints = FootprintArray.from_geodataframe(search_gdf)
+        np.testing.assert_array_equal(footprints.cloud_cover, self.footprints.cloud_cover)
+
+    def test_to_arrow_missing_outcome_id(self):
+        """Missing outcome ids become nulls in the Arrow table."""
+        footprints = FootprintArray.from_geometries([box(0, 0, 1, 1), box(1, 1, 2, 2)],
+                                                    ['2023-01-01', '2023-01-02'], ['aaaa', None], [1.0, 2.0])
+        self.assertEqual(list(footprints.outcome_codes), [0, -1])
+        table = footprints.to_arrow()
+        self.assertEqual(table.column('satl:outcome_id').to_pylist(), ['aaaa', None])
+        self.assertEqual(table.num_rows, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
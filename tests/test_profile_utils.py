@@ -0,0 +1,109 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for profileUtils."""
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pstats
+import tempfile
+import time
+from pathlib import Path
+
+from profileUtils import profile_action
+
+
+def _busy_work():
+    end = time.perf_counter() + 0.05
+    data = []
+    while time.perf_counter() < end:
+        data.append(list(range(100)))
+    return data
+
+
+class TestProfileAction(unittest.TestCase):
+    """Output files written by profile_action."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_disabled_writes_nothing(self):
+        """No mode means no profiling output."""
+        with profile_action("Option1", None, log_dir=self.log_dir):
+            _busy_work()
+        self.assertEqual(list(self.log_dir.iterdir()), [])
+
+    def test_cprofile_outputs(self):
+        """cProfile mode writes stats and an allocation report."""
+        with profile_action("Option3", "cprofile", log_dir=self.log_dir, top_n=5):
+            _busy_work()
+        suffixes = sorted(p.name.split("-")[-1] for p in self.log_dir.iterdir())
+        self.assertEqual(len(suffixes), 3)
+        self.assertTrue(any(s.endswith(".prof") for s in suffixes))
+        self.assertIn("alloc.txt", suffixes)
+        self.assertIn("stats.txt", suffixes)
+
+    def test_sample_outputs_folded_stacks(self):
+        """Sampling mode writes folded stacks that include the profiled function."""
+        with profile_action("Option6", "sample", log_dir=self.log_dir):
+            _busy_work()
+        folded = list(self.log_dir.glob("*.folded"))
+        self.assertEqual(len(folded), 1)
+        lines = folded[0].read_text().splitlines()
+        self.assertGreater(len(lines), 0)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("_busy_work" in line for line in lines))
+        self.assertEqual(len(list(self.log_dir.glob("*-alloc.txt"))), 1)
+
+    def test_cprofile_sees_worker_threads(self):
+        """Work done in a thread pool is in the cProfile stats."""
+        with profile_action("Option3", "cprofile", log_dir=self.log_dir):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(lambda _: _busy_work(), range(2)))
+        stats = pstats.Stats(str(next(self.log_dir.glob("*.prof"))))
+        self.assertTrue(any(func[2] == "_busy_work" for func in stats.stats))
+
+    def test_sample_sees_worker_threads(self):
+        """Stacks of pool threads are sampled and rooted at the thread name."""
+        with profile_action("Option6", "sample", log_dir=self.log_dir):
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="Worker") as executor:
+                executor.submit(_busy_work).result()
+        lines = next(self.log_dir.glob("*.folded")).read_text().splitlines()
+        self.assertTrue(any(line.startswith("Worker") and "_busy_work" in line for line in lines))
+        self.assertFalse(any(line.startswith("PeakSnapshotter") for line in lines))
+
+    def test_allocation_report_at_peak(self):
+        """Memory freed before the action ends still shows in the report."""
+        with profile_action("Option9", "cprofile", log_dir=self.log_dir):
+            data = [bytearray(1024) for _ in range(20000)]
+            time.sleep(0.2)
+            del data
+        report = next(self.log_dir.glob("*-alloc.txt")).read_text()
+        peak_kib = float(report.splitlines()[0].split(":")[1].split()[0])
+        self.assertGreater(peak_kib, 20000)
+        self.assertIn("test_profile_utils.py", report.splitlines()[2])
+
+    def test_output_written_when_action_raises(self):
+        """Reports are still written when the action is interrupted."""
+        with self.assertRaises(KeyboardInterrupt):
+            with profile_action("Option8", "cprofile", log_dir=self.log_dir):
+                raise KeyboardInterrupt
+        self.assertEqual(len(list(self.log_dir.glob("*-alloc.txt"))), 1)
+
+    def test_invalid_mode(self):
+        """Unknown modes are rejected."""
+        with self.assertRaises(ValueError):
+            with profile_action("Option1", "perf", log_dir=self.log_dir):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# Copyright (c) 2023 Satellogic USA Inc. All Rights Reserved.
+#
+# This file is part of Spotlite.
+#
+# This file is subject to the terms and conditions defined in the file 'LICENSE',
+# which is part of this source code package.
+
+"""Tests for revisitUtils."""
+
+import unittest
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, mapping, shape
+
+from footprintUtils import FootprintArray
+from revisitUtils import RevisitModel, refresh_search
+
+
+class TestRevisitModel(unittest.TestCase):
+    """Search planning with RevisitModel."""
+
+    def setUp(self):
+        # Daily captures over the cell at 0,0 and a single capture over the cell at 1,0.
+        dates = pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-03', '2023-01-04', '2023-01-04'])
+        geometries = [box(0.01, 0.01, 0.09, 0.09)] * 4 + [box(0.11, 0.01, 0.19, 0.09)]
+        self.footprints_gdf = gpd.GeoDataFrame({'capture_date': dates, 'satl:outcome_id': list('abcde'),
+                                                'cloud_cover': [0] * 5},
+                                               geometry=geometries, crs="EPSG:4326")
+        self.model = RevisitModel(cell_size_deg=0.1, quantile=0.5, min_captures=3)
+        self.model.update(self.footprints_gdf)
+        self.revisited_aoi = mapping(box(0.02, 0.02, 0.08, 0.08))
+        self.both_cells_aoi = mapping(box(0.02, 0.02, 0.18, 0.08))
+
+    def test_estimates(self):
+        """The next capture is expected one revisit interval after the last."""
+        cells = self.model.estimates()
+        self.assertEqual(cells.loc[(0, 0), 'n_captures'], 4)
+        self.assertEqual(cells.loc[(0, 0), 'earliest_next'], pd.Timestamp('2023-01-05'))
+        self.assertTrue(pd.isna(cells.loc[(1, 0), 'earliest_next']))
+
+    def test_skip_before_revisit(self):
+        """Searches are skipped before the next capture is possible."""
+        self.assertIsNone(self.model.plan_search(self.revisited_aoi, now='2023-01-04T12:00:00'))
+        self.assertEqual(self.model.searches_avoided, 1)
+
+    def test_search_after_revisit(self):
+        """Searches run once a new capture is possible."""
+        self.assertEqual(self.model.plan_search(self.revisited_aoi, now='2023-01-06'), self.revisited_aoi)
+        self.assertEqual(self.model.searches_made, 1)
+
+    def test_unknown_cells_searched(self):
+        """Cells without enough history are kept in the search area."""
+        refresh_aoi = self.model.plan_search(self.both_cells_aoi, now='2023-01-04T12:00:00')
+        self.assertAlmostEqual(shape(refresh_aoi).bounds[0], 0.1)
+        self.assertEqual(self.model.searches_made, 1)
+
+    def test_empty_model_searches(self):
+        """A model without history never skips."""
+        model = RevisitModel()
+        self.assertEqual(model.plan_search(self.revisited_aoi), self.revisited_aoi)
+
+    def test_footprint_array_input(self):
+        """FootprintArrays are accepted as history."""
+        model = RevisitModel(cell_size_deg=0.1, quantile=0.5)
+        model.update(FootprintArray.from_geodataframe(self.footprints_gdf))
+        self.assertEqual(len(model.history), len(self.model.history))
+
+    def test_save_load(self):
+        """History and counters survive a save and load."""
+        self.model.plan_search(self.revisited_aoi, now='2023-01-04T12:00:00')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'revisit_model.json'
+            self.model.save(path)
+            loaded = RevisitModel.load(path, quantile=0.5)
+        self.assertEqual(loaded.searches_avoided, 1)
+        pd.testing.assert_frame_equal(loaded.history, self.model.history)
+        self.assertIsNone(loaded.plan_search(self.revisited_aoi, now='2023-01-04T12:00:00'))
+
+
+
+CELL_A = box(0.01, 0.01, 0.09, 0.09)
+CELL_B = box(0.11, 0.01, 0.19, 0.09)
+
+
+class TestRefreshSearch(unittest.TestCase):
+    """Reuse of cached search results with refresh_search."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp_dir.name) / 'search_cache'
+        self.aoi = mapping(box(0.02, 0.02, 0.08, 0.08))
+        self.model = RevisitModel(cell_size_deg=0.1, quantile=0.5, min_captures=3)
+        self.calls = []
+        self.catalog = self._tiles([('a_0', 'a', '2023-01-01', CELL_A), ('b_0', 'b', '2023-01-02', CELL_A),
+                                    ('c_0', 'c', '2023-01-03', CELL_A), ('d_0', 'd', '2023-01-04', CELL_A)])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def _tiles(rows):
+        item_ids, outcome_ids, dates, geometries = zip(*rows)
+        return gpd.GeoDataFrame({'id': item_ids, 'capture_date': pd.to_datetime(dates),
+                                 'satl:outcome_id': outcome_ids, 'eo:cloud_cover': [0] * len(rows)},
+                                geometry=list(geometries), crs="EPSG:4326")
+
+    def _add_to_catalog(self, rows):
+        self.catalog = pd.concat([self.catalog, self._tiles(rows)], ignore_index=True)
+
+    def _get_tiles(self, aoi, start_date_str, end_date_str):
+        """Stands in for the archive: tiles intersecting aoi captured between the dates."""
+        self.calls.append((aoi, start_date_str, end_date_str))
+        dates = self.catalog['capture_date'].dt.normalize()
+        found = self.catalog[self.catalog.intersects(shape(aoi)) & (dates >= start_date_str)
+                             & (dates <= end_date_str)]
+        return found, len(found), found['satl:outcome_id'].nunique()
+
+    def _search(self, start_date_str='2023-01-01', end_date_str='2023-01-04', now='2023-01-04T12:00:00', aoi=None):
+        return refresh_search(self._get_tiles, self.model, aoi or self.aoi, start_date_str, end_date_str,
+                              cache_dir=self.cache_dir, now=now)
+
+    def test_first_search(self):
+        """The first search covers the whole query and updates the model."""
+        tiles_gdf = self._search()
+        self.assertEqual(self.calls, [(self.aoi, '2023-01-01', '2023-01-04')])
+        self.assertEqual(list(tiles_gdf['data_age']), [3, 2, 1, 0])
+        self.assertEqual(len(self.model.history), 4)
+
+    def test_repeat_before_revisit_reuses_result(self):
+        """Repeating the query before a revisit is possible does not search."""
+        first = self._search()
+        second = self._search(now='2023-01-04T18:00:00')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(list(second['id']), list(first['id']))
+        self.assertEqual(self.model.searches_avoided, 1)
+
+    def test_other_start_date_searched(self):
+        """A query with another start date is not answered from the cache."""
+        self._search()
+        self._search(start_date_str='2022-12-01', now='2023-01-04T18:00:00')
+        self.assertEqual(self.calls[1], (self.aoi, '2022-12-01', '2023-01-04'))
+
+    def test_refresh_after_revisit(self):
+        """After a revisit is possible only the new dates are searched and new tiles are added by item id."""
+        self._search()
+        # A tile of capture d published late is kept; tile d_0 found again is not repeated.
+        self._add_to_catalog([('d_1', 'd', '2023-01-04', CELL_A), ('e_0', 'e', '2023-01-06', CELL_A)])
+        tiles_gdf = self._search(end_date_str='2023-01-06', now='2023-01-06T12:00:00')
+        self.assertEqual(self.calls[1], (self.aoi, '2023-01-04', '2023-01-06'))
+        self.assertEqual(list(tiles_gdf['id']), ['a_0', 'b_0', 'c_0', 'd_0', 'd_1', 'e_0'])
+        self.assertEqual(self.model.estimates().loc[(0, 0), 'n_captures'], 5)
+
+    def test_skipped_cell_searched_from_its_last_search(self):
+        """A capture in a skipped cell that arrives earlier than expected is found by a later refresh."""
+        self.catalog = self._tiles([('a1', 'a1', '2023-02-01', CELL_A), ('a2', 'a2', '2023-02-06', CELL_A),
+                                    ('a3', 'a3', '2023-02-10', CELL_A), ('b1', 'b1', '2023-02-01', CELL_B),
+                                    ('a6', 'a6', '2023-02-12', CELL_A)])
+        aoi = mapping(box(0.02, 0.02, 0.18, 0.08))
+        self._search('2023-01-01', '2023-02-11', '2023-02-11T12:00:00', aoi)
+        # Cell A is not expected to be revisited before 02-15, so only B is searched.
+        self._search('2023-01-01', '2023-02-13', '2023-02-13T12:00:00', aoi)
+        self.assertAlmostEqual(shape(self.calls[1][0]).bounds[0], 0.1)
+        self.assertEqual(self.calls[1][1], '2023-02-11')
+
+        tiles_gdf = self._search('2023-01-01', '2023-02-25', '2023-02-25T12:00:00', aoi)
+        self.assertEqual(self.calls[2], (aoi, '2023-02-11', '2023-02-25'))
+        self.assertIn('a6', list(tiles_gdf['id']))
+
+    def test_past_end_date_not_cached(self):
+        """Queries ending in the past are searched every time."""
+        self._search(end_date_str='2023-01-03', now='2023-01-04T12:00:00')
+        self._search(end_date_str='2023-01-03', now='2023-01-04T12:00:00')
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(self.cache_dir.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()